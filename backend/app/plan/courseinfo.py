@@ -2,6 +2,7 @@
 Cache course info from the database in memory, for easy access.
 """
 
+import re
 from dataclasses import dataclass
 
 import pydantic
@@ -168,6 +169,9 @@ class CourseInfo:
 _course_info_cache: CourseInfo | None = None
 
 
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+
 def make_searchable_name(name: str) -> str:
     """
     Take a course name and normalize it to lowercase english letters, numbers and
@@ -175,7 +179,6 @@ def make_searchable_name(name: str) -> str:
     """
     name = unidecode(name)  # Remove accents
     name = name.lower()  # Make lowercase
-    name = "".join(
-        char if char.isalnum() else " " for char in name
-    )  # Remove non-alphanumeric characters
-    return " ".join(name.split())  # Merge adjacent spaces
+    # Remove non-alphanumeric characters, merging adjacent spaces
+    # `unidecode` only outputs ASCII, so these are the only alphanumeric characters left
+    return " ".join(_NON_ALNUM_RE.sub(" ", name).split())
@@ -3,6 +3,7 @@ from prisma.models import (
     AccessLevel as DbAccessLevel,
 )
 
+from app.sync.cache import CacheStats, cache_service
 from app.sync.database import sync_from_external_sources
 from app.sync.siding import translate as siding_translate
 from app.user.auth import (
@@ -24,8 +25,8 @@ async def sync_database(
     """
     Initiate a synchronization of the internal database from external sources.
 
-    NOTE: This endpoint is currently broken: a server restart is necessary after syncing
-    the database in order for the changes to reach all workers.
+    Workers notice that their static data is outdated within
+    `settings.static_data_check_interval` seconds, and reload it from the database.
     """
     await sync_from_external_sources(
         sync_coursedata=courses,
@@ -36,6 +37,42 @@ async def sync_database(
     }
 
 
+def _stats_overview(stats: CacheStats) -> dict[str, int | float | None]:
+    return {
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "hit_rate": stats.hit_rate(),
+    }
+
+
+@router.get("/cache")
+async def view_cache_stats(admin: AdminKey = Depends(require_admin_auth)):
+    """
+    Show the cache hit and miss counters of the worker that handles the request.
+    `static` counts checks of the static data version, and `students` counts student
+    info lookups.
+    """
+    return {
+        "static": _stats_overview(cache_service.static_stats),
+        "students": _stats_overview(cache_service.student_stats),
+    }
+
+
+@router.delete("/cache/student")
+async def invalidate_student_cache(
+    rut: Rut,
+    admin: AdminKey = Depends(require_admin_auth),
+):
+    """
+    Forget the cached info for the student with the specified RUT, so that it is
+    fetched from SIDING again on the next access.
+    """
+    await cache_service.invalidate_student(rut)
+    return {
+        "message": "Invalidated",
+    }
+
+
 @router.get("/mod", response_model=list[AccessLevelOverview])
 async def view_mods(user: AdminKey = Depends(require_admin_auth)):
     """
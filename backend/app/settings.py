@@ -108,12 +108,22 @@ class Settings(BaseSettings):
     # Time to expire cached student information in seconds.
     student_info_expire: float = 1800
 
+    # How often to check whether the static data (courses and curriculums) loaded in
+    # each worker is outdated, in seconds.
+    static_data_check_interval: float = 10
+
     # Whether to resynchronize courses on server startup.
     autosync_courses: bool = True
 
     # Whether to resynchronize curriculums on server startup.
     autosync_curriculums: bool = True
 
+    # Whether to validate the handwritten bypass curriculum data when synchronizing
+    # curriculums.
+    # The data is trusted and loaded without validation by default, because validating
+    # it is slow. Enable this after editing the bypass data, or in CI.
+    validate_bypass: bool = False
+
     # URL for the Redis server.
     redis_uri: RedisDsn = Field("redis://redis:6379/0")
 
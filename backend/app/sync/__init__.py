@@ -4,7 +4,6 @@ Currently using unofficial sources until we get better API access.
 """
 
 import logging
-from datetime import timedelta
 
 from fastapi import HTTPException
 
@@ -12,8 +11,7 @@ from app.plan.validation.curriculum.tree import (
     Curriculum,
     CurriculumSpec,
 )
-from app.redis import get_redis
-from app.settings import settings
+from app.sync.cache import cache_service
 from app.sync.database import curriculum_storage
 from app.sync.siding import translate as siding_translate
 from app.user.auth import UserKey, allow_force_login
@@ -55,34 +53,7 @@ async def get_curriculum(spec: CurriculumSpec) -> Curriculum:
 
 
 async def get_student_info(user: UserKey) -> StudentInfo:
-    lock_key = f"student-lock:{user.rut}"
-    data_key = f"student-data:{user.rut}"
-
-    async with get_redis() as redis:
-        lock = redis.lock(
-            lock_key,
-            # Just for safety
-            # If the machine crashes while the lock is held, we don't want the user to
-            # be permanently locked out of Planner
-            timeout=60,
-        )
-        async with lock:
-            # Use the data in redis if available
-            data = await redis.get(data_key)
-            if data is not None:
-                return StudentInfo.parse_raw(data)
-
-            # Data not in cache, fetch it while we hold the lock
-            info = await _fetch_student_data(user)
-
-            # Store the info in the redis db, with an expiry time
-            await redis.set(
-                data_key,
-                info.json(),
-                ex=timedelta(seconds=settings.student_info_expire),
-            )
-
-            return info
+    return await cache_service.get_student(user.rut, lambda: _fetch_student_data(user))
 
 
 async def _fetch_student_data(user: UserKey) -> StudentInfo:
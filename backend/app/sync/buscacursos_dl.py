@@ -1,13 +1,19 @@
+import asyncio
 import lzma
+import multiprocessing
+import os
+import re
 import traceback
-from collections.abc import Callable
-from typing import NoReturn
-
-import pydantic
-import requests
+from collections import defaultdict, deque
+from collections.abc import AsyncIterable, Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from typing import NoReturn, TypedDict
+
+import httpx
+import orjson
 from prisma.models import Course as DbCourse
 from prisma.types import CourseCreateWithoutRelationsInput
-from pydantic import BaseModel
 
 from app.plan.courseinfo import make_searchable_name
 from app.plan.validation.courses.logic import (
@@ -25,8 +31,12 @@ from app.plan.validation.courses.logic import (
 from app.plan.validation.courses.simplify import simplify
 from app.settings import settings
 
+# The format of the buscacursos-dl data.
+# The JSON is trusted and read as-is, without building or validating any models,
+# since every course is only read once.
+
 
-class BcSection(BaseModel):
+class BcSection(TypedDict):
     nrc: str
     teachers: str
     schedule: dict[str, list[str]]
@@ -39,7 +49,7 @@ class BcSection(BaseModel):
     quota: dict[str, int]
 
 
-class BcCourseInstance(BaseModel):
+class BcCourseInstance(TypedDict):
     name: str
     credits: int
     area: str
@@ -48,7 +58,7 @@ class BcCourseInstance(BaseModel):
     sections: dict[str, BcSection]
 
 
-class BcCourse(BaseModel):
+class BcCourse(TypedDict):
     name: str
     credits: int
     req: str
@@ -64,7 +74,55 @@ class BcCourse(BaseModel):
 BcData = dict[str, BcCourse]
 
 
+# Table of the repeated strings seen so far, to share a single copy of each.
+# This way, strings that are repeated across many courses are only pickled once when
+# sending translated courses back from the worker processes.
+_STRINGS: dict[str, str] = {}
+
+
+def _intern(s: str) -> str:
+    return _STRINGS.setdefault(s, s)
+
+
+# Size of the chunks in which the course data is downloaded and decompressed.
+_DOWNLOAD_CHUNK_SIZE = 1 << 16
+# Amount of courses inserted into the database per query.
+_INSERT_BATCH_SIZE = 500
+# Amount of courses translated at once by each worker process.
+_TRANSLATE_BATCH_SIZE = 256
+# Amount of batches queued per worker process, to bound memory usage.
+_TRANSLATE_BATCHES_PER_WORKER = 2
+
+
+# Whitespace between tokens
+_SPACE_RE = re.compile(r"\s*")
+# A course code, along with any whitespace after it
+_REQ_RE = re.compile(r"([^\W_]*)\s*")
+# An `lhs <cmp> rhs` restriction
+_RESTR_RE = re.compile(r"((?:[^\W_]|\s)*)([<=>]*)\s*([^)]*)")
+
+# Atoms are shared between all expressions that mention them, so that identical atoms
+# are only built (and hashed during simplification) once.
+# Like the parse caches, these live in the short-lived translation worker processes.
+_REQ_ATOMS: dict[tuple[str, bool], Expr] = {}
+_RESTR_ATOMS: dict[tuple[str, str, str], Expr] = {}
+
+
+def _join(build: type[And | Or], inner: list[Expr]) -> Expr:
+    if len(inner) == 1:
+        return inner[0]
+    return build(children=tuple(inner))
+
+
 class BcParser:
+    """
+    Parses the requirements and restrictions of a course, as formatted by buscacursos.
+    These are expressions like `IIC1103 y (MAT1610 o MAT1620(c))`, where `y` binds
+    tighter than `o`.
+    Each token is scanned with a regex, and parentheses are handled with an explicit
+    stack instead of recursion.
+    """
+
     s: str
     i: int
     is_restr: bool
@@ -74,17 +132,10 @@ class BcParser:
         self.i = 0
         self.is_restr = is_restr
 
-    def take(self, cond: Callable[[str], bool]):
-        prv = self.i
-        while self.i < len(self.s) and cond(self.s[self.i]):
-            self.i += 1
-        return self.s[prv : self.i]
-
     def trim(self):
-        return self.take(str.isspace)
-
-    def eof(self):
-        return self.i >= len(self.s)
+        m = _SPACE_RE.match(self.s, self.i)
+        assert m is not None
+        self.i = m.end()
 
     def bail(self, msg: str) -> NoReturn:
         ty = "restrictions" if self.is_restr else "requirements"
@@ -94,19 +145,6 @@ class BcParser:
         if not cond:
             self.bail(msg)
 
-    def peek(self, n: int = 1):
-        n = self.i + n
-        if n > len(self.s):
-            n = len(self.s)
-        return self.s[self.i : n]
-
-    def pop(self, n: int = 1):
-        prv = self.i
-        self.i += n
-        if self.i > len(self.s):
-            self.i = len(self.s)
-        return self.s[prv : self.i]
-
     def parse_property_eq(
         self,
         name: str,
@@ -129,14 +167,20 @@ class BcParser:
         return MinCredits(min_credits=cred)
 
     def parse_restr(self) -> Expr:
-        lhs = self.take(lambda c: c.isalnum() or c.isspace()).strip()
-        self.trim()
-        cmp = self.take(lambda c: c in "<=>")
-        self.trim()
-        rhs = self.take(lambda c: c != ")").strip()
+        m = _RESTR_RE.match(self.s, self.i)
+        assert m is not None
+        self.i = m.end()
+        lhs, cmp, rhs = m[1].strip(), m[2], m[3].strip()
         self.ensure(len(lhs) > 0, "expected an lhs")
         self.ensure(len(cmp) > 0, "expected a comparison operator")
         self.ensure(len(rhs) > 0, "expected an rhs")
+        key = (lhs, cmp, rhs)
+        atom = _RESTR_ATOMS.get(key)
+        if atom is None:
+            atom = _RESTR_ATOMS[key] = self.build_restr(lhs, cmp, rhs)
+        return atom
+
+    def build_restr(self, lhs: str, cmp: str, rhs: str) -> Expr:
         if lhs == "Nivel":
             return self.parse_property_eq(
                 "level",
@@ -170,115 +214,132 @@ class BcParser:
         return self.bail(f"unknown lhs '{lhs}'")
 
     def parse_req(self) -> Expr:
-        code = self.take(str.isalnum)
+        m = _REQ_RE.match(self.s, self.i)
+        assert m is not None
+        code = m[1]
+        self.i = m.end(1)
         self.ensure(len(code) > 0, "expected a course code")
-        self.trim()
+        self.i = m.end()
         co = False
-        if self.peek() == "(":
-            self.pop()
-            self.ensure(self.pop(2) == "c)", "expected (c)")
+        if self.s.startswith("(", self.i):
+            self.i = min(self.i + 3, len(self.s))
+            self.ensure(self.s[self.i - 2 : self.i] == "c)", "expected (c)")
             co = True
-        return ReqCourse(code=code, coreq=co)
-
-    def parse_unit(self) -> Expr:
-        self.trim()
-        self.ensure(not self.eof(), "expected an expression")
-
-        # Parse parenthesized unit
-        if self.peek() == "(":
-            self.pop()
-            inner = self.parse_orlist()
-            self.trim()
-            self.ensure(self.pop() == ")", "expected a closing parentheses")
-            return inner
-
-        # Parse unit
-        return self.parse_restr() if self.is_restr else self.parse_req()
-
-    def parse_andlist(self) -> Expr:
-        inner: list[Expr] = []
-        while True:
-            inner.append(self.parse_unit())
-            self.trim()
-            nxt = self.peek().lower()
-            if nxt == "" or nxt == ")" or nxt == "o":
-                break
-            if nxt == "y":
-                self.pop()
-            else:
-                self.bail("expected the end of the expression or a connector")
-        if len(inner) == 1:
-            return inner[0]
-        return And(children=tuple(inner))
-
-    def parse_orlist(self) -> Expr:
-        inner: list[Expr] = []
+        key = (code, co)
+        atom = _REQ_ATOMS.get(key)
+        if atom is None:
+            atom = _REQ_ATOMS[key] = ReqCourse(code=code, coreq=co)
+        return atom
+
+    def parse(self) -> Expr:
+        # The or-list and the current and-list of each open parenthesized group
+        stack: list[tuple[list[Expr], list[Expr]]] = []
+        ors: list[Expr] = []
+        ands: list[Expr] = []
         while True:
-            inner.append(self.parse_andlist())
+            # Parse a unit
             self.trim()
-            nxt = self.peek().lower()
-            if nxt == "" or nxt == ")":
-                break
-            if nxt == "o":
-                self.pop()
-            else:
-                self.bail("expected the end of the expression or a connector")
-        if len(inner) == 1:
-            return inner[0]
-        return Or(children=tuple(inner))
-
-
+            self.ensure(self.i < len(self.s), "expected an expression")
+            if self.s[self.i] == "(":
+                self.i += 1
+                stack.append((ors, ands))
+                ors, ands = [], []
+                continue
+            ands.append(self.parse_restr() if self.is_restr else self.parse_req())
+
+            # Parse a connector, closing any groups that end here
+            while True:
+                self.trim()
+                nxt = self.s[self.i : self.i + 1].lower()
+                if nxt == "y":
+                    self.i += 1
+                    break
+                if nxt == "o":
+                    self.i += 1
+                    ors.append(_join(And, ands))
+                    ands = []
+                    break
+                if nxt != "" and nxt != ")":
+                    self.bail("expected the end of the expression or a connector")
+                ors.append(_join(And, ands))
+                inner = _join(Or, ors)
+                if not stack:
+                    return inner
+                self.ensure(nxt == ")", "expected a closing parentheses")
+                self.i += 1
+                ors, ands = stack.pop()
+                ands.append(inner)
+
+
+# Many courses share the exact same requirement strings, so parsing is memoized.
+# Courses are translated in worker processes that only live for one sync, so the
+# caches do not outlive it.
+@cache
 def parse_reqs(reqs: str) -> Expr:
-    return BcParser(reqs, is_restr=False).parse_orlist()
+    return BcParser(reqs, is_restr=False).parse()
 
 
+@cache
 def parse_restr(restr: str) -> Expr:
-    return BcParser(restr, is_restr=True).parse_orlist()
+    return BcParser(restr, is_restr=True).parse()
 
 
-def parse_deps(c: BcCourse) -> Expr:
+def parse_deps(req: str, restr: str, conn: str) -> Expr:
     deps = None
-    if c.req != "No tiene":
-        deps = parse_reqs(c.req)
-    if c.restr != "No tiene":
-        restr = parse_restr(c.restr)
+    if req != "No tiene":
+        deps = parse_reqs(req)
+    if restr != "No tiene":
+        restr_expr = parse_restr(restr)
         if deps is None:
-            deps = restr
+            deps = restr_expr
         else:
-            if c.conn == "y":
-                deps = And(children=(deps, restr))
-            elif c.conn == "o":
-                deps = Or(children=(deps, restr))
+            if conn == "y":
+                deps = And(children=(deps, restr_expr))
+            elif conn == "o":
+                deps = Or(children=(deps, restr_expr))
             else:
-                raise Exception(f"invalid req/restr connector {c.conn}")
+                raise Exception(f"invalid req/restr connector {conn}")
     if deps is None:
         deps = Const(value=True)
     return deps
 
 
-def _translate_courses(data: BcData) -> list[CourseCreateWithoutRelationsInput]:
-    # Determine which semesters are scanned
-    print("  collecting course periods...")
-    period_set: set[str] = set()
-    for c in data.values():
-        period_set.update(c.instances.keys())
-    periods: dict[str, tuple[int, int]] = {}
-    for period in sorted(period_set):
-        year, semester = map(int, period.split("-"))
-        periods[period] = (year, semester)
+@cache
+def _deps_json(req: str, restr: str, conn: str) -> str:
+    """
+    Parse, simplify and serialize the dependencies of a course, in the format that is
+    stored in the database.
+    """
+    return simplify(parse_deps(req, restr, conn)).json()
 
-    # Process courses to place into database
-    print("  processing courses...")
+
+_NO_DEPS_JSON = Const(value=True).json()
+
+
+def _translate_batch(
+    batch: list[tuple[str, BcCourse]],
+) -> list[CourseCreateWithoutRelationsInput]:
+    """
+    Translate a batch of raw buscacursos-dl courses into the local format.
+    Runs in a worker process, so it only takes and returns plain data.
+    Inverse equivalencies are left empty, to be filled in by the caller.
+    """
     db_input: list[CourseCreateWithoutRelationsInput] = []
-    by_code: dict[str, CourseCreateWithoutRelationsInput] = {}
-    for code, c in data.items():
+    # Maps periods (eg. "2020-1") to the index of their semester in
+    # `available_in_semester`
+    period_to_sem: dict[str, int] = {}
+    for code, c in batch:
         try:
             # Parse and simplify dependencies
-            deps = simplify(parse_deps(c))
+            # Most courses have no dependencies at all, so skip the lookup for them
+            if c["req"] == "No tiene" and c["restr"] == "No tiene":
+                deps = _NO_DEPS_JSON
+            else:
+                deps = _deps_json(c["req"], c["restr"], c["conn"])
             # Parse equivalencies
             equivs: list[str] = []
-            if c.equiv != "No tiene":
-                equiv_expr = parse_reqs(c.equiv)
+            if c["equiv"] != "No tiene":
+                equiv_expr = parse_reqs(c["equiv"])
                 if isinstance(equiv_expr, ReqCourse):
                     assert not equiv_expr.coreq
                     equivs.append(equiv_expr.code)
@@ -290,81 +351,149 @@ def _translate_courses(data: BcData) -> list[CourseCreateWithoutRelationsInput]:
                         equivs.append(equiv_subexpr.code)
             # Figure out semestrality
             available_in_semester = [False, False]
-            for period in c.instances:
-                sem = periods[period][1] - 1
-                if sem == 2:
-                    # Consider TAV to be in the second semester
-                    sem = 1
+            instances = c["instances"]
+            for period in instances:
+                sem = period_to_sem.get(period)
+                if sem is None:
+                    sem = int(period.split("-")[1]) - 1
+                    if sem == 2:
+                        # Consider TAV to be in the second semester
+                        sem = 1
+                    period_to_sem[period] = sem
                 available_in_semester[sem] = True
+            # Use the info of the latest instance if available
+            latest = instances[max(instances)] if instances else None
             # Use names from buscacursos if available, because they have accents
-            name = max(c.instances.items())[1].name if c.instances else c.name
+            name = latest["name"] if latest else c["name"]
             # Queue for adding to database
             db_input.append(
                 {
                     "code": code,
                     "name": name,
                     "searchable_name": make_searchable_name(name),
-                    "credits": c.credits,
-                    "deps": deps.json(),
+                    "credits": c["credits"],
+                    "deps": deps,
                     "banner_equivs": equivs,
                     "banner_inv_equivs": [],
                     "canonical_equiv": code,
-                    "program": c.program,
-                    "school": c.school,
-                    "area": (
-                        c.instances[max(c.instances)].area or None
-                        if c.instances
-                        else None
-                    ),
+                    "program": _intern(c["program"]),
+                    "school": _intern(c["school"]),
+                    "area": _intern(latest["area"]) or None if latest else None,
                     "category": (
-                        c.instances[max(c.instances)].category or None
-                        if c.instances
-                        else None
+                        _intern(latest["category"]) or None if latest else None
                     ),
-                    "is_relevant": c.relevance == "Vigente",
+                    "is_relevant": c["relevance"] == "Vigente",
                     "is_available": any(available_in_semester),
                     "semestrality_first": available_in_semester[0],
                     "semestrality_second": available_in_semester[1],
                 },
             )
-            by_code[code] = db_input[-1]
         except Exception:  # noqa: BLE001 (we really want to ignore any exceptions)
             print(f"failed to process course {code}:")
             print(traceback.format_exc())
 
-    # Find inverse equivalencies
-    for course in db_input:
-        if "banner_equivs" not in course:
-            continue
-        for equiv_code in course["banner_equivs"]:
-            if equiv_code not in by_code:
-                continue
-            equiv = by_code[equiv_code]
-            if "banner_inv_equivs" not in equiv:
-                continue
-            equiv["banner_inv_equivs"].append(course["code"])
+    return db_input
 
+
+def _drain_batches(data: BcData) -> Iterator[list[tuple[str, BcCourse]]]:
+    """
+    Split the courses in the raw JSON data into batches, in order, removing them from
+    `data` so that their memory can be freed as soon as each batch is processed.
+    Sections are not needed to translate courses, so they are dropped instead of
+    being sent to the worker processes.
+    """
+    codes = list(data)
+    for i in range(0, len(codes), _TRANSLATE_BATCH_SIZE):
+        batch: list[tuple[str, BcCourse]] = []
+        for code in codes[i : i + _TRANSLATE_BATCH_SIZE]:
+            course = data.pop(code)
+            for instance in course["instances"].values():
+                instance["sections"] = {}
+            batch.append((code, course))
+        yield batch
+
+
+async def _translate_courses(data: BcData) -> list[CourseCreateWithoutRelationsInput]:
+    # Process courses to place into database
+    # Courses are independent of each other, so they are processed in parallel
+    print("  processing courses...")
+    loop = asyncio.get_running_loop()
+    workers = os.cpu_count() or 1
+    batches: list[list[CourseCreateWithoutRelationsInput]] = []
+    in_flight: deque[asyncio.Future[list[CourseCreateWithoutRelationsInput]]] = deque()
+    # Spawn fresh worker processes instead of forking the webapp, which is threaded
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        for batch in _drain_batches(data):
+            # Only queue a few batches at a time, so that the remaining course data
+            # is not copied all at once
+            if len(in_flight) >= workers * _TRANSLATE_BATCHES_PER_WORKER:
+                batches.append(await in_flight.popleft())
+            in_flight.append(loop.run_in_executor(pool, _translate_batch, batch))
+        while in_flight:
+            batches.append(await in_flight.popleft())
+
+    # Find inverse equivalencies
+    db_input: list[CourseCreateWithoutRelationsInput] = []
+    inv_equivs: defaultdict[str, list[str]] = defaultdict(list)
+    for batch in batches:
+        for course in batch:
+            course["banner_inv_equivs"] = inv_equivs[course["code"]]
+            for equiv_code in course.get("banner_equivs", []):
+                inv_equivs[equiv_code].append(course["code"])
+            db_input.append(course)
     return db_input
 
 
+async def _download_coursedata(dl_url: str) -> bytes:
+    """
+    Download and decompress the buscacursos-dl blob.
+    The data is decompressed as it arrives, so that the compressed blob is never held
+    in memory in its entirety.
+    """
+    async with httpx.AsyncClient(timeout=60) as client, client.stream(
+        "GET",
+        dl_url,
+        follow_redirects=True,
+    ) as resp:
+        resp.raise_for_status()
+        return await _decompress_xz(resp.aiter_bytes(_DOWNLOAD_CHUNK_SIZE))
+
+
+async def _decompress_xz(compressed: AsyncIterable[bytes]) -> bytes:
+    """
+    Decompress xz data as it arrives.
+    Like `lzma.decompress`, the data may consist of several concatenated xz streams.
+    """
+    decompressor = lzma.LZMADecompressor()
+    chunks: list[bytes] = []
+    async for chunk in compressed:
+        while chunk:
+            if decompressor.eof:
+                # A new stream starts right after the previous one
+                decompressor = lzma.LZMADecompressor()
+            chunks.append(decompressor.decompress(chunk))
+            chunk = decompressor.unused_data if decompressor.eof else b""
+    if not decompressor.eof:
+        raise Exception("truncated buscacursos-dl data")
+    return b"".join(chunks)
+
+
 async def fetch_to_database():
     # Fetch json blob from an unofficial source
     dl_url = settings.buscacursos_dl_url
-    print(f"  downloading course data from {dl_url}...")
-    # TODO: Use an async HTTP client
-    resp = requests.request("GET", dl_url, timeout=60)
-    resp.raise_for_status()
-
-    # Decompress
-    print("  decompressing data...")
-    resptext = lzma.decompress(resp.content).decode("UTF-8")
+    print(f"  downloading and decompressing course data from {dl_url}...")
+    raw = await _download_coursedata(dl_url)
 
     # Parse JSON
     print("  parsing JSON...")
-    data = pydantic.parse_raw_as(BcData, resptext)
+    data: BcData = orjson.loads(raw)
+    del raw
 
     # Translate buscacursos_dl data into the local format
-    db_input = _translate_courses(data)
+    db_input = await _translate_courses(data)
 
     # Figure out canonical equivalence for each course
     print("  finding newest versions of each course...")
@@ -382,5 +511,10 @@ async def fetch_to_database():
             c["canonical_equiv"] = canonical
 
     # Put courses in database
+    # Send them in batches, so that no single query carries the entire course list
+    # The batches are sent one after another, so that if one fails the error aborts
+    # the sync before the packed coursedata or the curriculums are built from a
+    # partially filled course table
     print("  storing courses in db...")
-    await DbCourse.prisma().create_many(data=db_input)
+    for i in range(0, len(db_input), _INSERT_BATCH_SIZE):
+        await DbCourse.prisma().create_many(data=db_input[i : i + _INSERT_BATCH_SIZE])
@@ -0,0 +1,191 @@
+"""
+Owns the in-process caches used by the webapp.
+
+- Static data (course info and curriculum storage) is loaded from the database into RAM.
+    Every time the static data is resynchronized, a version number stored in Redis is
+    bumped, so that all workers notice that their copy is stale and reload it.
+- Student info is cached in Redis, with an expiry time.
+
+Hits and misses are counted for each cache, to be able to tune expiry times.
+The counters are kept per worker, and are exposed through the admin API.
+"""
+
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import timedelta
+
+from app.plan.courseinfo import CourseInfo
+from app.redis import get_redis
+from app.settings import settings
+from app.sync.curriculums.storage import CurriculumStorage
+from app.user.info import StudentInfo
+from app.user.key import Rut
+from redis.exceptions import RedisError
+
+log = logging.getLogger("cache")
+
+
+CURRICULUM_VERSION_KEY = "curriculum-version"
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    def hit_rate(self) -> float | None:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+
+class CacheService:
+    course_info: CourseInfo | None
+    curriculum_storage: CurriculumStorage | None
+    # The version of the static data currently loaded in RAM, as reported by Redis at
+    # the time of loading.
+    curriculum_version: int | None
+    # When was the Redis curriculum version last checked, in `time.monotonic()` seconds.
+    version_checked_at: float
+    # Checks of the curriculum version in Redis.
+    # Hits found the static data up to date, misses found it stale.
+    static_stats: CacheStats
+    # Student info lookups.
+    # Hits were served from Redis, misses had to be fetched from SIDING.
+    student_stats: CacheStats
+
+    def __init__(self) -> None:
+        self.course_info = None
+        self.curriculum_storage = None
+        self.curriculum_version = None
+        self.version_checked_at = 0
+        self.static_stats = CacheStats()
+        self.student_stats = CacheStats()
+
+    def get_course_info(self) -> CourseInfo:
+        if self.course_info is None:
+            raise RuntimeError(
+                "attempt to use courseinfo before it is loaded from db",
+            )
+        return self.course_info
+
+    def get_curriculum_storage(self) -> CurriculumStorage:
+        if self.curriculum_storage is None:
+            raise RuntimeError(
+                "attempt to use curriculum storage before it is loaded from db",
+            )
+        return self.curriculum_storage
+
+    def set_static_data(
+        self,
+        courseinfo: CourseInfo,
+        storage: CurriculumStorage,
+        version: int | None,
+    ):
+        self.course_info = courseinfo
+        self.curriculum_storage = storage
+        self.curriculum_version = version
+        self.version_checked_at = time.monotonic()
+
+    async def fetch_curriculum_version(self) -> int | None:
+        """
+        Fetch the current version of the static data from Redis.
+        Returns `None` if Redis is unreachable.
+        """
+        try:
+            async with get_redis() as redis:
+                version = await redis.get(CURRICULUM_VERSION_KEY)
+        except RedisError as err:
+            log.warning("failed to fetch curriculum version from redis: %s", err)
+            return None
+        return int(version or 0)
+
+    async def bump_curriculum_version(self):
+        """
+        Signal all workers that the static data in the database changed, and that they
+        should reload it.
+        """
+        try:
+            async with get_redis() as redis:
+                version = await redis.incr(CURRICULUM_VERSION_KEY)
+        except RedisError as err:
+            log.warning(
+                "failed to bump curriculum version, workers must be restarted to"
+                " pick up the new data: %s",
+                err,
+            )
+            return
+        log.info("bumped curriculum version to %s", version)
+
+    async def is_curriculum_stale(self) -> bool:
+        """
+        Check whether the static data in RAM is outdated with respect to the database.
+        Redis is queried at most once every `settings.static_data_check_interval`
+        seconds, and only the first caller after that interval sees the stale data, so
+        that concurrent requests do not all reload the data at once.
+        Only actual checks against Redis are counted in `static_stats`: a hit means
+        that the data in RAM was up to date, and a miss means that it was stale.
+        """
+        now = time.monotonic()
+        if now - self.version_checked_at < settings.static_data_check_interval:
+            return False
+        self.version_checked_at = now
+        version = await self.fetch_curriculum_version()
+        if version is None:
+            return False
+        if version == self.curriculum_version:
+            self.static_stats.hits += 1
+            return False
+        self.static_stats.misses += 1
+        return True
+
+    async def get_student(
+        self,
+        rut: Rut,
+        fetch: Callable[[], Awaitable[StudentInfo]],
+    ) -> StudentInfo:
+        """
+        Get the cached student info for the given RUT, or call `fetch` to get it if it
+        is not cached.
+        """
+        lock_key = f"student-lock:{rut}"
+        data_key = f"student-data:{rut}"
+
+        async with get_redis() as redis:
+            lock = redis.lock(
+                lock_key,
+                # Just for safety
+                # If the machine crashes while the lock is held, we don't want the user
+                # to be permanently locked out of Planner
+                timeout=60,
+            )
+            async with lock:
+                # Use the data in redis if available
+                data = await redis.get(data_key)
+                if data is not None:
+                    self.student_stats.hits += 1
+                    return StudentInfo.parse_raw(data)
+
+                # Data not in cache, fetch it while we hold the lock
+                self.student_stats.misses += 1
+                info = await fetch()
+
+                # Store the info in the redis db, with an expiry time
+                await redis.set(
+                    data_key,
+                    info.json(),
+                    ex=timedelta(seconds=settings.student_info_expire),
+                )
+
+                return info
+
+    async def invalidate_student(self, rut: Rut):
+        """
+        Forget the cached info for the given student, forcing a refetch on next access.
+        """
+        async with get_redis() as redis:
+            await redis.delete(f"student-data:{rut}")
+
+
+cache_service = CacheService()
@@ -4,10 +4,12 @@ directamente en el formato universal.
 """
 
 from dataclasses import dataclass, field
+from itertools import chain
+from typing import Any, ClassVar, Literal
 
 from pydantic import BaseModel, Field
 
-from app.plan.course import ConcreteId, EquivalenceId
+from app.plan.course import ConcreteId, EquivalenceId, PseudoCourse
 from app.plan.courseinfo import CourseDetails, EquivDetails
 from app.plan.validation.curriculum.tree import (
     Block,
@@ -21,6 +23,9 @@ from app.plan.validation.curriculum.tree import (
 from app.sync.curriculums.siding import SidingInfo
 from app.sync.curriculums.storage import CurriculumStorage
 
+# Debug name of the combination that holds all the top-level blocks
+_ROOT_DEBUG_NAME = "Raíz"
+
 
 class BypassFiller(BaseModel):
     order: list[int]
@@ -29,10 +34,12 @@ class BypassFiller(BaseModel):
     unessential: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class LiveBypassFiller:
     code: str
-    courses: list[str] = field(default_factory=list)
+    # The courses of each leaf in the subtree, in order
+    # They are concatenated only once, when the filler is created
+    courses: list[list[str]] = field(default_factory=list)
 
 
 class BypassBase(BaseModel):
@@ -44,11 +51,15 @@ class BypassBase(BaseModel):
 
 
 class BypassCombination(BypassBase):
+    # Distinguishes the node types without going through `isinstance`, which is slow
+    # for pydantic models
+    is_combination: ClassVar[Literal[True]] = True
     cap: int | None = None
     children: list["BypassNode"]
 
 
 class BypassLeaf(BypassBase):
+    is_combination: ClassVar[Literal[False]] = False
     credits: int
     codes: list[str] | str
 
@@ -57,16 +68,55 @@ BypassNode = BypassCombination | BypassLeaf
 
 BypassCombination.update_forward_refs()
 
+# A node to translate, along with its layer, superblock and filler, and whether its
+# children have already been translated
+_TranslateTask = tuple[BypassNode, str, str | None, "LiveBypassFiller | None", bool]
+
 
 class BypassEquivalentGroup(BaseModel):
     equivalents: set[str]
     max_credits: int
 
 
+def _construct_filler(raw: dict[str, Any] | None) -> BypassFiller | None:
+    return None if raw is None else BypassFiller.construct(**raw)
+
+
+def _construct_node(raw: dict[str, Any]) -> BypassNode:
+    filler = _construct_filler(raw.get("filler"))
+    if "children" in raw:
+        return BypassCombination.construct(
+            **{
+                **raw,
+                "filler": filler,
+                "children": [_construct_node(child) for child in raw["children"]],
+            },
+        )
+    return BypassLeaf.construct(**{**raw, "filler": filler})
+
+
 class Bypass(BaseModel):
     blocks: list[BypassNode]
     groups: list[BypassEquivalentGroup] = Field(default_factory=list)
 
+    @staticmethod
+    def construct_trusted(raw: dict[str, Any]) -> "Bypass":
+        """
+        Build a bypass out of its raw JSON representation, without validating it.
+        Validating the recursive tree of nodes is slow, and the bypass data is written
+        by hand by us, so it can be checked with `settings.validate_bypass` instead.
+        """
+        return Bypass.construct(
+            blocks=[_construct_node(node) for node in raw["blocks"]],
+            groups=[
+                BypassEquivalentGroup.construct(
+                    equivalents=set(group["equivalents"]),
+                    max_credits=group["max_credits"],
+                )
+                for group in raw.get("groups", [])
+            ],
+        )
+
     def translate(
         self,
         courses: dict[str, CourseDetails],
@@ -74,17 +124,31 @@ class Bypass(BaseModel):
         storage: CurriculumStorage,
         spec: CurriculumSpec,
         unique_id: str,
+        siding_codes: dict[str, list[str]] | None = None,
     ) -> Curriculum:
         """
         Translate a human-friendly "bypass" format into a curriculum specification.
+        `siding_codes` caches the known courses of each SIDING list, and can be shared
+        between translations that use the same courses and SIDING info.
         """
 
         curr = Curriculum.empty(spec)
 
         # Translate the curriculum tree
-        translator = BypassTranslator(courses, siding, unique_id, curr, storage)
+        translator = BypassTranslator(
+            courses,
+            siding,
+            unique_id,
+            curr,
+            storage,
+            siding_codes={} if siding_codes is None else siding_codes,
+        )
         root, _creds = translator.translate(
-            BypassCombination(debug_name="Raíz", children=self.blocks),
+            # The blocks are already validated, so do not validate (and copy) them
+            BypassCombination.construct(
+                debug_name=_ROOT_DEBUG_NAME,
+                children=self.blocks,
+            ),
             "",
             None,
             None,
@@ -98,7 +162,7 @@ class Bypass(BaseModel):
         return curr
 
 
-@dataclass
+@dataclass(slots=True)
 class BypassTranslator:
     courses: dict[str, CourseDetails]
     siding: SidingInfo
@@ -107,6 +171,8 @@ class BypassTranslator:
     storage: CurriculumStorage
     equiv_counter: int = 0
     seen_fillers: dict[int, EquivDetails | str] = field(default_factory=dict)
+    # The known courses in each SIDING list referenced so far
+    siding_codes: dict[str, list[str]] = field(default_factory=dict)
 
     def translate(
         self,
@@ -116,10 +182,66 @@ class BypassTranslator:
         filler: LiveBypassFiller | None,
     ) -> tuple[Block, int]:
         """
-        Recursively translate a particular node.
+        Translate the tree rooted at a particular node.
         Passes down the current layer, superblock and filler.
+        The tree is walked depth-first using an explicit stack instead of recursion.
         """
 
+        # Nodes to visit, along with the context inherited from their parent
+        # Combinations are visited twice: once before translating their children, and
+        # once after (when the flag is set)
+        stack: list[_TranslateTask] = [(bypass, layer, superblock, filler, False)]
+        # Translated blocks and their credits, waiting to be collected by their parent
+        done: list[tuple[Block, int]] = []
+        while stack:
+            bypass, layer, superblock, filler, children_done = stack.pop()
+            if children_done:
+                assert bypass.is_combination is True
+                block, credits = self.translate_combination(bypass, done)
+            else:
+                layer, superblock, filler = self.enter_node(
+                    bypass,
+                    layer,
+                    superblock,
+                    filler,
+                )
+                if bypass.is_combination is True:
+                    # This node represents a combination of children nodes
+                    if not bypass.children:
+                        raise Exception("found combination node with 0 children")
+                    # Come back once all children are translated, which are pushed in
+                    # reverse so that they are translated in order
+                    stack.append((bypass, layer, superblock, filler, True))
+                    stack.extend(
+                        (child, layer, superblock, filler, False)
+                        for child in reversed(bypass.children)
+                    )
+                    continue
+                # This node represents a leaf of the tree
+                if filler is None:
+                    raise Exception("found a leaf with no fillers in path to root")
+                if superblock is None:
+                    raise Exception("found a leaf with no superblock")
+                block = self.translate_leaf(bypass, layer, superblock, filler)
+                credits = bypass.credits
+            if bypass.filler is not None:
+                assert filler is not None
+                self.finish_filler(bypass, filler, credits)
+            done.append((block, credits))
+        assert len(done) == 1
+        return done[0]
+
+    def enter_node(
+        self,
+        bypass: BypassNode,
+        layer: str,
+        superblock: str | None,
+        filler: LiveBypassFiller | None,
+    ) -> tuple[str, str | None, LiveBypassFiller | None]:
+        """
+        Update the layer, superblock and filler that a node passes down to its
+        subtree.
+        """
         if bypass.layer is not None:
             layer = bypass.layer
         if bypass.superblock is not None:
@@ -129,8 +251,9 @@ class BypassTranslator:
             if filler is not None:
                 raise Exception("found nested fillers")
             # If the order number is reused, also reuse the equivalence itself
+            # Usually none of the orders have been seen, so check that case quickly
             previous = self.seen_fillers.get(bypass.filler.order[0])
-            if any(
+            if not self.seen_fillers.keys().isdisjoint(bypass.filler.order) and any(
                 order in self.seen_fillers and previous != self.seen_fillers[order]
                 for order in bypass.filler.order
             ):
@@ -142,64 +265,48 @@ class BypassTranslator:
             )
             # Collect courses in the subtree
             filler = LiveBypassFiller(code=code)
-        if isinstance(bypass, BypassCombination):
-            # This node represents a combination of children nodes
-            if not bypass.children:
-                raise Exception("found combination node with 0 children")
-            block, credits = self.translate_combination(
-                bypass,
-                layer,
-                superblock,
-                filler,
-            )
-        else:
-            # This node represents a leaf of the tree
-            if filler is None:
-                raise Exception("found a leaf with no fillers in path to root")
-            if superblock is None:
-                raise Exception("found a leaf with no superblock")
-            block = self.translate_leaf(bypass, layer, superblock, filler)
-            credits = bypass.credits
-        if bypass.filler is not None:
-            assert filler is not None
-            # We have finished processing all nodes in the subtree
-            # Therefore, we have collected all courses in the subtree, and we can create
-            # the equivalence and filler
-            fillers_to_add = self.create_filler(
-                filler,
-                bypass.filler,
-                bypass.name,
-                credits,
+        return layer, superblock, filler
+
+    def finish_filler(
+        self,
+        bypass: BypassNode,
+        filler: LiveBypassFiller,
+        credits: int,
+    ):
+        """
+        Create the equivalence and fillers of a node that has a filler, once all of the
+        nodes in its subtree are processed, and therefore all of its courses have been
+        collected.
+        """
+        assert bypass.filler is not None
+        fillers_to_add = self.create_filler(
+            filler,
+            bypass.filler,
+            bypass.name,
+            credits,
+        )
+        # Add the created fillers to the curriculum
+        # All of them fill in with the same course, so add them all at once
+        if fillers_to_add:
+            self.out.fillers.setdefault(fillers_to_add[0].course.code, []).extend(
+                fillers_to_add,
             )
-            # Add the created fillers to the curriculum
-            for filler_to_add in fillers_to_add:
-                self.out.fillers.setdefault(filler_to_add.course.code, []).append(
-                    filler_to_add,
-                )
-        return block, credits
 
     def translate_combination(
         self,
         bypass: BypassCombination,
-        layer: str,
-        superblock: str | None,
-        filler: LiveBypassFiller | None,
+        done: list[tuple[Block, int]],
     ) -> tuple[Combination, int]:
-        # Process the children
-        children: list[Block] = []
-        credits = 0
-        for child in bypass.children:
-            child_block, child_creds = self.translate(
-                child,
-                layer,
-                superblock,
-                filler,
-            )
-            children.append(child_block)
-            credits += child_creds
+        # Collect the translated children, which are the last blocks to be translated
+        n = len(bypass.children)
+        children = [block for block, _creds in done[-n:]]
+        credits = sum(creds for _block, creds in done[-n:])
+        del done[-n:]
         if bypass.cap is not None:
             credits = bypass.cap
-        block = Combination(
+        # The children were already validated as they were built, so skip validating
+        # (and copying) the entire subtree again at every level
+        block = Combination.construct(
             debug_name=bypass.debug_name,
             name=bypass.name,
             cap=-1 if bypass.cap is None else bypass.cap,
@@ -218,28 +325,43 @@ class BypassTranslator:
         codes = bypass.codes
         if isinstance(codes, str):
             # This node references a SIDING list
-            if codes not in self.siding.lists:
-                raise Exception(f"unknown siding list '{codes}'")
-            codes = [
-                curso.Sigla
-                for curso in self.siding.lists[codes]
-                if curso.Sigla and curso.Sigla in self.courses
-            ]
-        for code in codes:
-            if code not in self.courses:
+            codes = self.get_siding_codes(codes)
+            code_set = set(codes)
+        else:
+            code_set = set(codes)
+            unknown = code_set.difference(self.courses)
+            if unknown:
+                code = next(code for code in codes if code in unknown)
                 raise Exception(f"unknown course '{code}'")
         # Add the courses to the courses in the filler equivalence
-        filler.courses.extend(codes)
+        filler.courses.append(codes)
         return Leaf(
             debug_name=bypass.debug_name,
             name=bypass.name,
             superblock=superblock,
             cap=bypass.credits,
             list_code=filler.code,
-            codes=set(codes),
+            codes=code_set,
             layer=layer,
         )
 
+    def get_siding_codes(self, list_name: str) -> list[str]:
+        """
+        Get the known courses in a SIDING list.
+        Lists are usually referenced by several leaves, so they are only filtered once.
+        """
+        codes = self.siding_codes.get(list_name)
+        if codes is None:
+            if list_name not in self.siding.lists:
+                raise Exception(f"unknown siding list '{list_name}'")
+            codes = [
+                curso.Sigla
+                for curso in self.siding.lists[list_name]
+                if curso.Sigla and curso.Sigla in self.courses
+            ]
+            self.siding_codes[list_name] = codes
+        return codes
+
     def create_filler(
         self,
         live_filler: LiveBypassFiller,
@@ -250,60 +372,69 @@ class BypassTranslator:
         """
         Create filler courses from the given filler info.
         May create a concrete course or an equivalence based on the amount of courses.
+        All of the created fillers refer to the same course.
         """
-        if not live_filler.courses:
+        courses = list(chain.from_iterable(live_filler.courses))
+        if not courses:
             raise Exception("found filler with no courses")
+        # The bypass data may be reused across translations, so do not modify it
+        homogeneous = filler.homogeneous
         # If there is a single course, we can extract metadata from it
-        if len(live_filler.courses) == 1:
-            main_code = live_filler.courses[0]
+        if len(courses) == 1:
+            main_code = courses[0]
             if main_code not in self.courses:
                 raise Exception(f"unknown single-course equivalence {main_code}")
             info = self.courses[main_code]
             if name is None:
                 name = info.name
             credits = info.credits
-            filler.homogeneous = True
+            homogeneous = True
         if name is None:
             raise Exception("found nameless filler")
         # Create the equivalence
         equiv = EquivDetails(
             code=live_filler.code,
             name=name,
-            is_homogeneous=filler.homogeneous,
+            is_homogeneous=homogeneous,
             is_unessential=filler.unessential,
-            courses=live_filler.courses,
+            courses=courses,
         )
         # Add the equivalence
-        self.storage.lists[equiv.code] = equiv
-        # Create the fillers
-        fillers_to_add: list[FillerCourse] = []
-        for order in filler.order:
-            if order in self.seen_fillers:
-                # Ensure that the filler is compatible
-                if self.seen_fillers[order] != equiv:
+        self.storage.add_list(equiv)
+        # Ensure that the fillers that were already seen are compatible
+        # Usually none of the orders have been seen, so check that case quickly
+        if not self.seen_fillers.keys().isdisjoint(filler.order):
+            for order in filler.order:
+                if order in self.seen_fillers and self.seen_fillers[order] != equiv:
                     raise Exception(
                         f"incompatible fillers with order {order}:"
                         f" {self.seen_fillers[order]} and {equiv}",
                     )
-                # This filler has already been seen, continue
-                continue
-            equiv_course = EquivalenceId(
-                code=equiv.code,
-                credits=_ceil_div(credits, len(filler.order)),
+        # Create the fillers that have not been seen yet
+        # All of them fill in with the same course, so build it only once
+        equiv_course: PseudoCourse = EquivalenceId(
+            code=equiv.code,
+            credits=_ceil_div(credits, len(filler.order)),
+        )
+        if homogeneous:
+            equiv_course = ConcreteId(
+                code=courses[0],
+                equivalence=equiv_course,
             )
-            if filler.homogeneous:
-                equiv_course = ConcreteId(
-                    code=live_filler.courses[0],
-                    equivalence=equiv_course,
-                )
-            fillers_to_add.append(
-                FillerCourse(
-                    course=equiv_course,
-                    order=order,
-                    cost_offset=filler.cost_offset,
-                ),
+        new_orders = [
+            order
+            for order in dict.fromkeys(filler.order)
+            if order not in self.seen_fillers
+        ]
+        fillers_to_add = [
+            FillerCourse.construct(
+                course=equiv_course,
+                order=order,
+                cost_offset=filler.cost_offset,
             )
-            self.seen_fillers[order] = equiv
+            for order in new_orders
+        ]
+        self.seen_fillers.update(dict.fromkeys(new_orders, equiv))
         return fillers_to_add
 
     def next_equiv_code(self) -> str:
@@ -312,16 +443,18 @@ class BypassTranslator:
 
     def translate_multiplicity(self, groups: list[BypassEquivalentGroup]):
         for group in groups:
-            for code in group.equivalents:
-                if code in self.out.multiplicity:
-                    raise Exception(
-                        f"found non-transitive equivalent group {group.equivalents}",
-                    )
-            for code in group.equivalents:
-                self.out.multiplicity[code] = Multiplicity(
-                    group=group.equivalents,
-                    credits=group.max_credits,
+            if not self.out.multiplicity.keys().isdisjoint(group.equivalents):
+                raise Exception(
+                    f"found non-transitive equivalent group {group.equivalents}",
                 )
+            # All courses in the group share the same multiplicity, which is never
+            # modified after being created
+            multiplicity = Multiplicity.construct(
+                group=set(group.equivalents),
+                credits=group.max_credits,
+            )
+            for code in group.equivalents:
+                self.out.multiplicity[code] = multiplicity
 
 
 def _ceil_div(a: int, b: int) -> int:
@@ -3,12 +3,15 @@ Collates information from various sources to build a complete curriculum plan
 specification.
 """
 
+import asyncio
 import logging
 from collections import defaultdict
 from collections.abc import Iterable
 from dataclasses import dataclass, field
 from itertools import chain
+from pathlib import Path
 
+import orjson
 from pydantic import BaseModel
 
 from app.plan.course import ConcreteId, EquivalenceId
@@ -25,6 +28,7 @@ from app.plan.validation.curriculum.tree import (
     TitleCode,
     cyear_from_str,
 )
+from app.settings import settings
 from app.sync.curriculums.bypass import Bypass
 from app.sync.curriculums.major import (
     translate_common_plan,
@@ -48,6 +52,8 @@ from app.sync.siding.client import (
 
 log = logging.getLogger("plan-collator")
 
+BYPASS_PATH = Path("../static-curriculum-data/bypass.json")
+
 
 class BypassProgram(BaseModel):
     major: MajorCode | None = None
@@ -62,22 +68,24 @@ class BypassInfo(BaseModel):
     titles: list[BypassProgram]
 
 
-class ScrapedInfo(BaseModel):
+@dataclass(slots=True, frozen=True)
+class ScrapedInfo:
     majors: set[MajorCode]
     minors: dict[MinorCode, list[ScrapedProgram]]
     titles: dict[TitleCode, ScrapedProgram]
 
 
 async def collate_plans(courses: dict[str, CourseDetails]) -> CurriculumStorage:
-    # Scrape information from PDFs
-    scraped = ScrapedInfo(
-        majors=scrape_majors(),
-        minors=scrape_minors(courses),
-        titles=scrape_titles(courses),
+    # Scrape information from PDFs, and fetch information from SIDING
+    # Scraping does not need SIDING, so it runs in other threads while waiting for
+    # SIDING to respond
+    majors, minors, titles, siding = await asyncio.gather(
+        asyncio.to_thread(scrape_majors),
+        asyncio.to_thread(scrape_minors, courses),
+        asyncio.to_thread(scrape_titles, courses),
+        fetch_siding(courses),
     )
-
-    # Fetch information from SIDING
-    siding = await fetch_siding(courses)
+    scraped = ScrapedInfo(majors=majors, minors=minors, titles=titles)
 
     # Algunos titulos se agregan manualmente
     add_manual_title_offer(siding)
@@ -120,21 +128,18 @@ async def collate_plans(courses: dict[str, CourseDetails]) -> CurriculumStorage:
     # Tratar las equivalencias homogeneas
     detect_homogeneous(courses, out)
 
-    # Asegurarse que no hayan equivalencias vacias
-    for equiv in out.lists.values():
-        if not equiv.courses:
-            raise Exception(f"list {equiv.code} is empty")
+    # Las equivalencias vacias se rechazan al agregarlas a `out`, con `add_list`
 
     # Durante la construccion de los curriculums se usa la capacidad -1 como un
     # placeholder, que significa "la capacidad de este nodo es la suma de las
     # capacidades de mis hijos"
     # Por ende, hay que actualizar estas capacidades
+    # Ademas, determinar qué cursos si o si tienen que dictarse en algun momento, para
+    # evitar el warning de "este curso no se ha dictado nunca" para cursos nuevos
+    # Esto depende de las capacidades finales, asi que se hace justo despues de
+    # congelarlas, en una sola pasada por los planes
     for curr in out.all_plans():
         curr.root.freeze_capacities()
-
-    # Determinar qué cursos si o si tienen que dictarse en algun momento, para evitar el
-    # warning de "este curso no se ha dictado nunca" para cursos nuevos
-    for curr in out.all_plans():
         _extract_must_have_courses(curr.root, out.must_have_courses)
 
     # TODO: Algunos minors y titulos tienen requerimientos especiales que no son
@@ -196,38 +201,36 @@ def extract_true_offer(
     # single type
     # However, Python thinks it may result in a list of mixed types, so a type: ignore
     # is needed
+    # Collect the codes in the offer along the way, to check against the scraped plans
+    available: set[str] = set()
     for program in offer:
+        # Los datos del programa son los mismos para todos sus curriculums, y nunca se
+        # modifican, asi que se comparten
+        details, keep_others = program_details(program)
+        available.add(details.code)
+        is_major = isinstance(program, Major)
+        is_minor = isinstance(program, Minor)
         for cyear_str in decode_cyears(program.Curriculum):
             cyear = cyear_from_str(cyear_str)
             assert cyear is not None
-            result = filter_program(
+            if filter_program(
                 cyear,
-                program,
+                details,
+                keep_others,
                 siding,
                 scraped,
                 counter,
                 require_siding,
-            )
-            if result is not None:
-                if isinstance(program, Major):
-                    out[cyear].major[result.code] = result
-                elif isinstance(program, Minor):
-                    out[cyear].minor[result.code] = result
+            ):
+                if is_major:
+                    out[cyear].major[details.code] = details
+                elif is_minor:
+                    out[cyear].minor[details.code] = details
                 else:
-                    out[cyear].title[result.code] = result
+                    out[cyear].title[details.code] = details
 
     # Make sure all scraped plans are present in the offer
-    available: set[str] = set()
-    for program in offer:
-        if isinstance(program, Major):
-            available.add(program.CodMajor)
-        elif isinstance(program, Minor):
-            available.add(program.CodMinor)
-        else:
-            available.add(program.CodTitulo)
-    for code in scraped:
-        if code not in available:
-            counter.not_in_offer.add(code)
+    counter.not_in_offer.update(scraped.difference(available))
 
     # Print results
     if counter.not_in_scrape:
@@ -295,20 +298,12 @@ def clean_curriculum_offer(
     )
 
 
-def filter_program(
-    cyear: Cyear,
-    program: Major | Minor | Titulo,
-    siding: SidingInfo,
-    scraped: set[str],
-    counter: FilteredCounter,
-    require_siding: bool,
-) -> ProgramDetails | None:
+def program_details(program: Major | Minor | Titulo) -> tuple[ProgramDetails, bool]:
     """
-    Procesar el programa `program`, y convertirlo en un `ProgramDetails`.
-    Si determinamos que este programa no esta realmente disponible, retornamos `None`.
+    Extraer los datos de un programa de SIDING que no dependen del curriculum.
+    Tambien retorna si hay que mantener los bloques de otros programas en su malla.
     """
 
-    keep_others = False
     if isinstance(program, Major):
         code = program.CodMajor
         version = program.VersionMajor
@@ -318,32 +313,50 @@ def filter_program(
         code = program.CodMinor
         version = program.VersionMinor
         program_type = program.TipoMinor
+        keep_others = False
     else:
         code = program.CodTitulo
         version = program.VersionTitulo
         program_type = program.TipoTitulo
+        keep_others = False
+
+    details = ProgramDetails(
+        code=code,
+        name=program.Nombre,
+        version=version or "",
+        program_type=program_type,
+    )
+    return details, keep_others
+
 
+def filter_program(
+    cyear: Cyear,
+    program: ProgramDetails,
+    keep_others: bool,
+    siding: SidingInfo,
+    scraped: set[str],
+    counter: FilteredCounter,
+    require_siding: bool,
+) -> bool:
+    """
+    Procesar el programa `program` en el curriculum `cyear`.
+    Si determinamos que este programa no esta realmente disponible, retornamos `False`.
+    """
+
+    code = program.code
     if code not in scraped:
         counter.not_in_scrape.add(code)
-        return None
+        return False
 
-    blocks = filter_relevant_blocks(
-        program.Nombre,
-        siding.plans[cyear].plans.get(code, []),
-        keep_others,
-    )
+    plans = siding.plans[cyear].plans
+    blocks = filter_relevant_blocks(program.name, plans.get(code, []), keep_others)
     if not blocks:
         counter.no_malla.add(code)
         if require_siding:
-            return None
-    siding.plans[cyear].plans[code] = blocks
+            return False
+    plans[code] = blocks
 
-    return ProgramDetails(
-        code=code,
-        name=program.Nombre,
-        version=version or "",
-        program_type=program_type,
-    )
+    return True
 
 
 def filter_relevant_blocks(
@@ -351,27 +364,26 @@ def filter_relevant_blocks(
     plan: list[BloqueMalla],
     keep_others: bool,
 ) -> list[BloqueMalla]:
-    for block in plan:
-        if _is_block_relevant(plan_name, block):
-            break
-    else:
-        # No hay ningun bloque que calce con el nombre del plan!
-        # Es decir, los bloques del plan no tienen nada que ver con lo que se pidio, y
-        # por ende el plan es probablemente basura
-        return []
-
+    relevant_names = {plan_name, "Plan Común"}
+    relevant: list[BloqueMalla] = []
+    found_relevant = False
     for block in plan:
         if block.CodSigla is None and block.CodLista is None:
             # Que hacer con este bloque??
             return []
+        if block.Programa in relevant_names:
+            found_relevant = True
+            relevant.append(block)
+        elif keep_others:
+            relevant.append(block)
 
-    return [
-        block for block in plan if _is_block_relevant(plan_name, block) or keep_others
-    ]
-
+    if not found_relevant:
+        # No hay ningun bloque que calce con el nombre del plan!
+        # Es decir, los bloques del plan no tienen nada que ver con lo que se pidio, y
+        # por ende el plan es probablemente basura
+        return []
 
-def _is_block_relevant(plan_name: str, block: BloqueMalla) -> bool:
-    return block.Programa == plan_name or block.Programa == "Plan Común"
+    return relevant
 
 
 def translate_all_majors(
@@ -381,8 +393,11 @@ def translate_all_majors(
     out: CurriculumStorage,
 ):
     for cyear, offer in out.offer.items():
+        # Los bloques de cada programa ya fueron filtrados al limpiar la oferta
+        plans = siding.plans[cyear].plans
         for major in offer.major.values():
-            if major.code not in siding.plans[cyear].plans:
+            blocks = plans.get(major.code)
+            if blocks is None:
                 continue
             spec = CurriculumSpec(
                 cyear=cyear,
@@ -395,7 +410,7 @@ def translate_all_majors(
                 out,
                 spec,
                 siding,
-                siding.plans[cyear].plans[major.code],
+                blocks,
             )
 
 
@@ -406,10 +421,13 @@ def translate_all_minors(
     out: CurriculumStorage,
 ):
     for cyear, offer in out.offer.items():
+        plans = siding.plans[cyear].plans
         for minor_meta in offer.minor.values():
-            if MinorCode(minor_meta.code) not in scraped.minors:
+            minor_scrapes = scraped.minors.get(MinorCode(minor_meta.code))
+            if minor_scrapes is None:
                 continue
-            for minor_scrape in scraped.minors[MinorCode(minor_meta.code)]:
+            blocks = plans.get(minor_meta.code, [])
+            for minor_scrape in minor_scrapes:
                 spec = CurriculumSpec(
                     cyear=cyear,
                     major=minor_scrape.assoc_major,
@@ -422,7 +440,7 @@ def translate_all_minors(
                     spec,
                     minor_meta,
                     siding,
-                    siding.plans[cyear].plans.get(minor_meta.code, []),
+                    blocks,
                     minor_scrape,
                 )
 
@@ -434,10 +452,11 @@ def translate_all_titles(
     out: CurriculumStorage,
 ):
     for cyear, offer in out.offer.items():
+        plans = siding.plans[cyear].plans
         for title in offer.title.values():
-            if TitleCode(title.code) not in scraped.titles:
+            scrape = scraped.titles.get(TitleCode(title.code))
+            if scrape is None:
                 continue
-            scrape = scraped.titles[TitleCode(title.code)]
             spec = CurriculumSpec(
                 cyear=cyear,
                 major=scrape.assoc_major,
@@ -450,7 +469,7 @@ def translate_all_titles(
                 spec,
                 title,
                 siding,
-                siding.plans[cyear].plans.get(title.code, []),
+                plans.get(title.code, []),
                 scrape,
             )
 
@@ -460,11 +479,12 @@ def extract_major_minor_associations(siding: SidingInfo, out: CurriculumStorage)
     Extraer la asociacion entre majors y minors a partir de la informacion de SIDING.
     """
     for _cyear, offer in out.offer.items():
+        offered_minors = offer.minor.keys()
         for major_code in offer.major:
             offer.major_minor[major_code] = [
                 minor.CodMinor
                 for minor in siding.major_minor[major_code]
-                if minor.CodMinor in offer.minor
+                if minor.CodMinor in offered_minors
             ]
 
 
@@ -489,44 +509,53 @@ def detect_homogeneous(courses: dict[str, CourseDetails], out: CurriculumStorage
     by fillers that represent concrete courses. In particular, the concrete course that
     represents the homogeneous equivalence.
     """
+    # Whether an equivalence is homogeneous does not depend on the plan, so determine
+    # the default course of each homogeneous equivalence only once
+    representatives = {
+        equiv.code: equiv.courses[0]
+        for equiv in out.lists.values()
+        if (equiv.is_homogeneous and len(equiv.courses) >= 1) or len(equiv.courses) == 1
+    }
+    if not representatives:
+        return
+
     for curr in out.all_plans():
         # Fix the fillers
-        obsolete_filler_codes: list[str] = []
+        # The fillers that are kept as-is, in their original order
+        kept_fillers: dict[str, list[FillerCourse]] = {}
         new_fillers: dict[str, list[FillerCourse]] = {}
         for filler_code, old_fillers in curr.fillers.items():
-            equiv = out.lists.get(filler_code)
-            if equiv is not None and (
-                (equiv.is_homogeneous and len(equiv.courses) >= 1)
-                or len(equiv.courses) == 1
-            ):
-                # Determine the default course to use
-                representative = equiv.courses[0]
-                if representative not in courses:
-                    raise Exception(
-                        f"equivalence {equiv.code}"
-                        f" has unknown representative {representative}",
-                    )
+            representative = representatives.get(filler_code)
+            if representative is None:
+                kept_fillers[filler_code] = old_fillers
+                continue
+            if representative not in courses:
+                raise Exception(
+                    f"equivalence {filler_code}"
+                    f" has unknown representative {representative}",
+                )
 
-                # Replace these fillers
-                obsolete_filler_codes.append(equiv.code)
-                for equiv_filler in old_fillers:
-                    assert isinstance(equiv_filler.course, EquivalenceId)
-                    new_fillers.setdefault(representative, []).append(
-                        FillerCourse(
-                            course=ConcreteId(
-                                code=representative,
-                                equivalence=equiv_filler.course,
-                            ),
-                            order=equiv_filler.order,
-                            cost_offset=equiv_filler.cost_offset,
+            # Replace these fillers
+            for equiv_filler in old_fillers:
+                assert isinstance(equiv_filler.course, EquivalenceId)
+                new_fillers.setdefault(representative, []).append(
+                    FillerCourse(
+                        course=ConcreteId(
+                            code=representative,
+                            equivalence=equiv_filler.course,
                         ),
-                    )
+                        order=equiv_filler.order,
+                        cost_offset=equiv_filler.cost_offset,
+                    ),
+                )
 
-        # Actually modify the fillers
-        for remove_this_code in obsolete_filler_codes:
-            del curr.fillers[remove_this_code]
+        # Actually modify the fillers, rebuilding the filler dict in a single pass
+        if len(kept_fillers) == len(curr.fillers):
+            # Nothing to replace in this plan
+            continue
         for add_this_code, add_these_fillers in new_fillers.items():
-            curr.fillers.setdefault(add_this_code, []).extend(add_these_fillers)
+            kept_fillers.setdefault(add_this_code, []).extend(add_these_fillers)
+        curr.fillers = kept_fillers
 
 
 def patch_globally(courses: dict[str, CourseDetails], out: CurriculumStorage):
@@ -542,19 +571,23 @@ def patch_globally(courses: dict[str, CourseDetails], out: CurriculumStorage):
     _force_subcourses(courses, out)
 
 
-FORCE_HOMOGENEOUS_EQUIVS = (
-    {"FIS1523", "ICM1003", "IIQ1003", "IIQ103H"},
-    {"FIS1533", "IEE1533"},
-    {"ICS1113", "ICS113H"},
+FORCE_HOMOGENEOUS_EQUIVS = frozenset(
+    {
+        frozenset({"FIS1523", "ICM1003", "IIQ1003", "IIQ103H"}),
+        frozenset({"FIS1533", "IEE1533"}),
+        frozenset({"ICS1113", "ICS113H"}),
+    },
+)
+_FORCE_HOMOGENEOUS_MAX_LEN = max(
+    len(homogeneous) for homogeneous in FORCE_HOMOGENEOUS_EQUIVS
 )
 
 
 def _mark_homogeneous_equivs(courses: dict[str, CourseDetails], out: CurriculumStorage):
-    max_len = max(len(homogeneous) for homogeneous in FORCE_HOMOGENEOUS_EQUIVS)
     for equiv in out.lists.values():
-        if len(equiv.courses) <= max_len and any(
-            set(equiv.courses) == homogeneous
-            for homogeneous in FORCE_HOMOGENEOUS_EQUIVS
+        if (
+            len(equiv.courses) <= _FORCE_HOMOGENEOUS_MAX_LEN
+            and frozenset(equiv.courses) in FORCE_HOMOGENEOUS_EQUIVS
         ):
             equiv.is_homogeneous = True
 
@@ -571,10 +604,14 @@ UNESSENTIAL_EQUIVS = {
     "C10351",
 }
 
+# Las listas se identifican por el sufijo de su codigo, asi que se revisan todos los
+# sufijos de una vez con `str.endswith`
+_UNESSENTIAL_SUFFIXES = tuple(UNESSENTIAL_EQUIVS)
+
 
 def _mark_unessential_equivs(courses: dict[str, CourseDetails], out: CurriculumStorage):
     for list_code, equiv in out.lists.items():
-        if any(list_code.endswith(unessential) for unessential in UNESSENTIAL_EQUIVS):
+        if list_code.endswith(_UNESSENTIAL_SUFFIXES):
             equiv.is_unessential = True
 
 
@@ -593,16 +630,20 @@ def _limit_multiplicity(courses: dict[str, CourseDetails], out: CurriculumStorag
     limitado para todos los curriculums.
     """
 
+    # Las multiplicidades nunca se modifican, asi que se comparten entre curriculums
+    limits = [
+        Multiplicity(group=group, credits=credit_limit)
+        for group, credit_limit in _MULTIPLICITY_LIMITS
+    ]
     for curr in out.all_plans():
-        for group, credit_limit in _MULTIPLICITY_LIMITS:
-            mult = Multiplicity(group=group, credits=credit_limit)
-            for course in group:
-                if course in curr.multiplicity and curr.multiplicity[course] != mult:
+        for mult in limits:
+            for course in mult.group:
+                previous = curr.multiplicity.setdefault(course, mult)
+                if previous != mult:
                     raise Exception(
                         f"attempt to set multiplicity of {course} to {mult}, "
-                        f"but it already has multiplicity {curr.multiplicity[course]}",
+                        f"but it already has multiplicity {previous}",
                     )
-                curr.multiplicity[course] = mult
 
 
 _FORCE_SUBCOURSES = {
@@ -610,6 +651,8 @@ _FORCE_SUBCOURSES = {
     "ICS113H": "ICS1113",
 }
 
+_FORCE_SUBCOURSE_PAIRS = tuple(_FORCE_SUBCOURSES.items())
+
 
 def _force_subcourses(courses: dict[str, CourseDetails], out: CurriculumStorage):
     """
@@ -627,30 +670,59 @@ def _force_subcourses(courses: dict[str, CourseDetails], out: CurriculumStorage)
 
     # Add supercourses to equivalencies that only have the subcourse
     for equiv in out.lists.values():
-        for sub, super in _FORCE_SUBCOURSES.items():
+        for sub, super in _FORCE_SUBCOURSE_PAIRS:
             if sub in equiv.courses and super not in equiv.courses:
                 equiv.courses.append(super)
 
     # Make all blocks that accept subcourses accept the supercourse
-    def add_supercourses(node: Block):
+    # Walk all of the trees with an explicit stack instead of recursing on every node
+    stack: list[Block] = [curr.root for curr in out.all_plans()]
+    while stack:
+        node = stack.pop()
         if isinstance(node, Leaf):
-            for sub, super in _FORCE_SUBCOURSES.items():
-                if sub in node.codes:
-                    node.codes.add(super)
+            codes = node.codes
+            for sub, super in _FORCE_SUBCOURSE_PAIRS:
+                if sub in codes:
+                    codes.add(super)
         else:
-            for child in node.children:
-                add_supercourses(child)
+            stack.extend(node.children)
 
-    for curr in out.all_plans():
-        add_supercourses(curr.root)
+
+# El bypass ya cargado, junto a la fecha de modificacion del archivo del que se leyo
+_bypass_cache: tuple[int, BypassInfo] | None = None
 
 
 def load_bypass(
     courses: dict[str, CourseDetails],
     scraped: ScrapedInfo,
     siding: SidingInfo,
-):
-    return BypassInfo.parse_file("../static-curriculum-data/bypass.json")
+) -> BypassInfo:
+    global _bypass_cache
+
+    # El archivo es estatico, asi que se reutiliza mientras no cambie
+    mtime = BYPASS_PATH.stat().st_mtime_ns
+    if _bypass_cache is not None and _bypass_cache[0] == mtime:
+        return _bypass_cache[1]
+    bypass = _read_bypass()
+    _bypass_cache = (mtime, bypass)
+    return bypass
+
+
+def _read_bypass() -> BypassInfo:
+    if settings.validate_bypass:
+        return BypassInfo.parse_file(BYPASS_PATH)
+    raw = orjson.loads(BYPASS_PATH.read_bytes())
+    return BypassInfo.construct(
+        **{
+            kind: [
+                BypassProgram.construct(
+                    **{**program, "plan": Bypass.construct_trusted(program["plan"])},
+                )
+                for program in raw[kind]
+            ]
+            for kind in ("majors", "minors", "titles")
+        },
+    )
 
 
 def translate_bypass(
@@ -665,6 +737,9 @@ def translate_bypass(
     Este formato se mapea muy directo a la representacion interna, pero es mas facil de
     escribir a mano que el formato interno.
     """
+    # Las listas de SIDING que referencia el bypass son las mismas para todos los
+    # programas, asi que se filtran una sola vez
+    siding_codes: dict[str, list[str]] = {}
     for cyear, _offer in out.offer.items():
         for bp in bypass.majors:
             spec = CurriculumSpec(
@@ -675,7 +750,14 @@ def translate_bypass(
             )
             out.set_major(
                 spec,
-                bp.plan.translate(courses, siding, out, spec, f"MAJOR-{spec}"),
+                bp.plan.translate(
+                    courses,
+                    siding,
+                    out,
+                    spec,
+                    f"MAJOR-{spec}",
+                    siding_codes,
+                ),
             )
         for bp in bypass.minors:
             spec = CurriculumSpec(
@@ -686,7 +768,14 @@ def translate_bypass(
             )
             out.set_minor(
                 spec,
-                bp.plan.translate(courses, siding, out, spec, f"MINOR-{spec}"),
+                bp.plan.translate(
+                    courses,
+                    siding,
+                    out,
+                    spec,
+                    f"MINOR-{spec}",
+                    siding_codes,
+                ),
             )
         for bp in bypass.titles:
             spec = CurriculumSpec(
@@ -697,5 +786,12 @@ def translate_bypass(
             )
             out.set_title(
                 spec,
-                bp.plan.translate(courses, siding, out, spec, f"TITLE-{spec}"),
+                bp.plan.translate(
+                    courses,
+                    siding,
+                    out,
+                    spec,
+                    f"TITLE-{spec}",
+                    siding_codes,
+                ),
             )
@@ -150,7 +150,7 @@ def scrape_minor(
                 )
             areas.pop(0)
             for area_name, area_raw in zip(areas[::2], areas[1::2], strict=True):
-                log.debug(f"        processing area {area_name}")
+                log.debug("        processing area %s", area_name)
                 process_block(
                     courses,
                     out,
@@ -332,8 +332,8 @@ def add_level_3000_courses(
             faculty_codes,
         )
         if course_codes:
-            log.debug(f"            on top of {len(course_codes)} explicit courses")
-        log.debug(f'            based on text "{reference_text}"')
+            log.debug("            on top of %s explicit courses", len(course_codes))
+        log.debug('            based on text "%s"', reference_text)
 
         # Buscar los cursos con el codigo especificado y nivel 3000
         extra_courses: list[tuple[str, str | None]] = []
@@ -160,8 +160,11 @@ def scrape_block(
                 faculty_codes,
             )
             if course_codes:
-                log.debug(f"            on top of {len(course_codes)} explicit courses")
-            log.debug(f'            based on text "{reference_text}"')
+                log.debug(
+                    "            on top of %s explicit courses",
+                    len(course_codes),
+                )
+            log.debug('            based on text "%s"', reference_text)
 
             # Buscar los cursos con el codigo especificado y nivel 3000
             extra_courses: list[tuple[str, str | None]] = []
@@ -188,7 +188,7 @@ class ListBuilder:
                 equiv,
                 self.storage.lists[lcode],
             )
-        self.storage.lists[lcode] = equiv
+        self.storage.add_list(equiv)
         self.added_lists += 1
         return equiv
 
@@ -438,7 +438,7 @@ def translate_block(
         available_options: list[str] = []
         for code in block.options:
             if code not in courses:
-                log.warning(f"unknown course {code} in scrape of {spec}")
+                log.warning("unknown course %s in scrape of %s", code, spec)
                 continue
             available_options.append(code)
 
@@ -299,8 +299,9 @@ def translate_siding(
                     continue
                 if curso.Sigla not in courses:
                     log.warning(
-                        f"unknown course {curso.Sigla}"
-                        f" in SIDING list {raw_block.CodLista}",
+                        "unknown course %s in SIDING list %s",
+                        curso.Sigla,
+                        raw_block.CodLista,
                     )
                     continue
                 codes.append(curso.Sigla)
@@ -325,12 +326,14 @@ def translate_siding(
         # Extract the ordering of this course
         recommended_order = raw_block.SemestreBloque * 10 + raw_block.OrdenSemestre
         # Add the equivalence to the global list of equivalences
-        out.lists[list_code] = EquivDetails(
-            code=list_code,
-            name=raw_block.Nombre,
-            is_homogeneous=is_homogeneous,
-            is_unessential=False,
-            courses=codes,
+        out.add_list(
+            EquivDetails(
+                code=list_code,
+                name=raw_block.Nombre,
+                is_homogeneous=is_homogeneous,
+                is_unessential=False,
+                courses=codes,
+            ),
         )
         # Add the recommended course to the list of fillers
         curriculum.fillers.setdefault(recommended.code, []).append(
@@ -1,7 +1,9 @@
 from collections import defaultdict
-from collections.abc import Iterator
+from collections.abc import Callable, Iterator
 from itertools import chain
+from typing import Any
 
+import orjson
 from pydantic import BaseModel, Field
 
 from app.plan.courseinfo import EquivDetails
@@ -12,6 +14,13 @@ def _try_get(dict: dict[str, Curriculum], spec: CurriculumSpec) -> Curriculum |
     return dict.get(str(spec))
 
 
+def _orjson_dumps(v: Any, *, default: Callable[[Any], Any]) -> str:  # noqa: ANN401
+    # orjson produces bytes, but pydantic expects a string
+    # Some dicts are keyed by `str` subclasses (eg. `MajorCode`), which orjson rejects
+    # unless `OPT_NON_STR_KEYS` is set
+    return orjson.dumps(v, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 class ProgramDetails(BaseModel):
     code: str
     name: str
@@ -26,7 +35,12 @@ class ProgramOffer(BaseModel):
     major_minor: dict[str, list[str]] = Field(default_factory=dict)
 
 
-class CurriculumStorage(BaseModel):
+class CurriculumStorage(BaseModel, json_loads=orjson.loads, json_dumps=_orjson_dumps):
+    """
+    The storage is serialized as a single large JSON blob, so it uses `orjson` instead
+    of the standard library `json` module.
+    """
+
     offer: defaultdict[Cyear, ProgramOffer] = Field(
         default_factory=lambda: defaultdict(ProgramOffer),
     )
@@ -78,5 +92,15 @@ class CurriculumStorage(BaseModel):
     def set_title(self, spec: CurriculumSpec, curr: Curriculum):
         self.titles[str(spec)] = curr
 
+    def add_list(self, equiv: EquivDetails):
+        """
+        Add an equivalence to the global list of equivalences.
+        Equivalences never lose courses once added, so empty equivalences are rejected
+        right here.
+        """
+        if not equiv.courses:
+            raise Exception(f"list {equiv.code} is empty")
+        self.lists[equiv.code] = equiv
+
     def all_plans(self) -> Iterator[Curriculum]:
         return chain(self.majors.values(), self.minors.values(), self.titles.values())
@@ -180,7 +180,7 @@ def build_opi_equiv(
     )
 
     # Almacenar la equivalencia para reusarla en otros planes
-    out.lists[opi_code] = opi_equiv
+    out.add_list(opi_equiv)
     return opi_equiv
 
 
@@ -15,6 +15,7 @@ In the future, this info might also include:
 - RamosUC-based metadata
 """
 
+import asyncio
 import logging
 from typing import TYPE_CHECKING
 
@@ -30,11 +31,14 @@ from prisma.models import Title as DbTitle
 
 from app.plan.courseinfo import CourseDetails, CourseInfo, EquivDetails
 from app.sync import buscacursos_dl
+from app.sync.cache import cache_service
 from app.sync.curriculums.collate import collate_plans
 from app.sync.curriculums.storage import CurriculumStorage
 
 if TYPE_CHECKING:
     from prisma.types import (
+        EquivalenceCourseCreateWithoutRelationsInput,
+        EquivalenceCreateInput,
         MajorCreateInput,
         MajorMinorCreateInput,
         MinorCreateInput,
@@ -43,25 +47,49 @@ if TYPE_CHECKING:
 
 log = logging.getLogger("db-sync")
 
-
-_static_course_info: CourseInfo | None = None
-_static_curriculum_storage: CurriculumStorage | None = None
+# Amount of rows inserted into the database per query.
+_INSERT_BATCH_SIZE = 500
 
 
 async def course_info() -> CourseInfo:
-    if _static_course_info is None:
-        raise RuntimeError(
-            "attempt to use courseinfo before it is loaded from db",
-        )
-    return _static_course_info
+    await _reload_if_stale()
+    return cache_service.get_course_info()
 
 
 async def curriculum_storage() -> CurriculumStorage:
-    if _static_curriculum_storage is None:
-        raise RuntimeError(
-            "attempt to use curriculum storage before it is loaded from db",
-        )
-    return _static_curriculum_storage
+    await _reload_if_stale()
+    return cache_service.get_curriculum_storage()
+
+
+# The background task reloading the static data, if a reload is in progress.
+_reload_task: "asyncio.Task[None] | None" = None
+
+
+async def _reload_if_stale():
+    """
+    If the static data was resynchronized since it was loaded into RAM, reload it.
+    The reload runs in the background, and the old data keeps being served until the
+    new data is swapped in.
+    Only one reload runs at a time.
+    """
+    global _reload_task
+    if _reload_task is None and await cache_service.is_curriculum_stale():
+        log.info("static data is outdated, reloading in the background")
+        _reload_task = asyncio.create_task(_reload_in_background())
+    if _reload_task is not None and cache_service.course_info is None:
+        # There is no old data to serve meanwhile, so wait for the reload
+        await asyncio.shield(_reload_task)
+
+
+async def _reload_in_background():
+    global _reload_task
+    try:
+        await load_packed_data_from_db()
+    except Exception:
+        # The old data is kept, and the reload is retried on the next version check
+        log.exception("failed to reload static data")
+    finally:
+        _reload_task = None
 
 
 COURSEDATA_PACK_ID: str = "course-data"
@@ -69,33 +97,39 @@ CURRICULUMS_PACK_ID: str = "curriculum-storage"
 
 
 async def load_packed_data_from_db():
-    global _static_course_info, _static_curriculum_storage
-
     log.info("loading static data from db to local memory")
 
+    # Fetch the version before loading the data, so that a sync that runs while the
+    # data is being loaded is not missed
+    version = await cache_service.fetch_curriculum_version()
+
     # Load coursedata
     log.info("  fetching packed coursedata from db")
-    courses: dict[str, CourseDetails] = pydantic.parse_raw_as(
+    # Parsing takes a while, so do it in a thread to avoid blocking the event loop
+    courses: dict[str, CourseDetails] = await asyncio.to_thread(
+        pydantic.parse_raw_as,
         dict[str, CourseDetails],
         await load_packed(COURSEDATA_PACK_ID),
     )
 
     # Load curriculum data
     log.info("  fetching packed curriculum data from db")
-    storage: CurriculumStorage = CurriculumStorage.parse_raw(
+    storage: CurriculumStorage = await asyncio.to_thread(
+        CurriculumStorage.parse_raw,
         await load_packed(CURRICULUMS_PACK_ID),
     )
 
-    # Save courseinfo in RAM
-    _static_course_info = CourseInfo(
-        courses=courses,
-        equivs=storage.lists,
-        must_have_courses=storage.must_have_courses,
+    # Save courseinfo and curriculum storage in RAM
+    cache_service.set_static_data(
+        CourseInfo(
+            courses=courses,
+            equivs=storage.lists,
+            must_have_courses=storage.must_have_courses,
+        ),
+        storage,
+        version,
     )
 
-    # Save curriculum storage in RAM
-    _static_curriculum_storage = storage
-
     log.info(
         "  loaded %s courses, %s equivalences and %s plans",
         len(courses),
@@ -105,6 +139,8 @@ async def load_packed_data_from_db():
 
 
 async def sync_from_external_sources(sync_coursedata: bool, sync_curriculum: bool):
+    courses: dict[str, CourseDetails] | None = None
+
     if sync_coursedata:
         log.info("syncing coursedata")
 
@@ -117,7 +153,7 @@ async def sync_from_external_sources(sync_coursedata: bool, sync_curriculum: boo
         await buscacursos_dl.fetch_to_database()
 
         log.info("  updating packed coursedata")
-        await _update_packed_coursedata_in_database()
+        courses = await _update_packed_coursedata_in_database()
 
     # If we sync coursedata, we must delete courses from the database
     # If we delete courses from the database, we must delete equivalences (because they
@@ -127,52 +163,66 @@ async def sync_from_external_sources(sync_coursedata: bool, sync_curriculum: boo
     if sync_curriculum or sync_coursedata:
         log.info("syncing currriculum data")
 
-        log.info("  loading course data")
-        courses: dict[str, CourseDetails] = pydantic.parse_raw_as(
-            dict[str, CourseDetails],
-            await load_packed(COURSEDATA_PACK_ID),
-        )
+        if courses is None:
+            # If the coursedata was just synced, reuse it instead of parsing it back
+            log.info("  loading course data")
+            courses = pydantic.parse_raw_as(
+                dict[str, CourseDetails],
+                await load_packed(COURSEDATA_PACK_ID),
+            )
 
         log.info("  collating plans")
         storage = await collate_plans(courses)
 
+        # The tables are written one after another, and the packed curriculum data
+        # last
+        # If a write fails the sync is aborted, and the previous packed data is kept
+        # and workers are not told to reload, but tables that were already replaced
+        # keep their new data until the next sync
         log.info("  saving curriculum data to db")
-        await _save_packed(CURRICULUMS_PACK_ID, storage.json())
-
-        log.info("  clearing equivalences from db")
-        await DbEquivalenceCourse.prisma().delete_many()
-        await DbEquivalence.prisma().delete_many()
-
-        log.info("  saving equivalences to db")
-        await _store_equivalences_to_db(storage.lists)
-
+        await _replace_equivalences_in_db(storage.lists)
         if sync_curriculum:
             # Store new offer to database
-            log.info("  syncing curriculum offer")
             await _store_curriculum_offer_to_db(storage)
+        await _save_packed(CURRICULUMS_PACK_ID, storage.json())
+
+        # Make workers reload the static data
+        await cache_service.bump_curriculum_version()
 
 
-async def _update_packed_coursedata_in_database():
+async def _update_packed_coursedata_in_database() -> dict[str, CourseDetails]:
     """
     Fetch all courses from database, pack them, and store the compacted JSON in the
     database.
+    Returns the packed courses.
     """
     log.info("    loading courses from db")
     all_courses = await DbCourse.prisma().find_many()
+    courses = {course.code: CourseDetails.from_db(course) for course in all_courses}
     log.info("    packing into json")
-    course_dict = (
-        f'"{course.code}":{CourseDetails.from_db(course).json()}'
-        for course in all_courses
-    )
+    course_dict = (f'"{code}":{course.json()}' for code, course in courses.items())
     packed = f"{{{','.join(course_dict)}}}"
     print("    storing to database")
     await _save_packed(COURSEDATA_PACK_ID, packed)
+    return courses
+
+
+async def _replace_equivalences_in_db(lists: dict[str, EquivDetails]):
+    log.info("  clearing equivalences from db")
+    await DbEquivalenceCourse.prisma().delete_many()
+    await DbEquivalence.prisma().delete_many()
+
+    log.info("  saving equivalences to db")
+    await _store_equivalences_to_db(lists)
 
 
 async def _store_equivalences_to_db(lists: dict[str, EquivDetails]):
+    equivs: list[EquivalenceCreateInput] = []
+    equiv_courses: list[EquivalenceCourseCreateWithoutRelationsInput] = []
     for equiv in lists.values():
-        # Add equivalence to database
-        await DbEquivalence.prisma().create(
+        if not equiv.courses:
+            raise Exception(f"equivalence {equiv.code} has no courses?")
+        equivs.append(
             {
                 "code": equiv.code,
                 "name": equiv.name,
@@ -180,24 +230,27 @@ async def _store_equivalences_to_db(lists: dict[str, EquivDetails]):
                 "is_unessential": equiv.is_unessential,
             },
         )
-        # Add the courses of the equivalence to database
-        value_tuples: list[str] = []
-        query_args = [equiv.code]
+        # If a course is repeated, only its first appearance is stored
+        first_index: dict[str, int] = {}
         for i, code in enumerate(equiv.courses):
-            value_tuples.append(
-                f"({i}, $1, ${2+i})",
-            )  # NOTE: No user-input is injected here
-            query_args.append(code)
-        if len(value_tuples) == 0:
-            raise Exception(f"equivalence {equiv.code} has no courses?")
-        await DbEquivalenceCourse.prisma().query_raw(
-            f"""
-            INSERT INTO "EquivalenceCourse" (index, equiv_code, course_code)
-            VALUES {','.join(value_tuples)}
-            ON CONFLICT
-            DO NOTHING
-            """,  # noqa: S608 (only numbers are inserted in string)
-            *query_args,
+            first_index.setdefault(code, i)
+        equiv_courses.extend(
+            {"index": i, "equiv_code": equiv.code, "course_code": code}
+            for code, i in first_index.items()
+        )
+
+    # Add the equivalences to the database, and only then their courses, which
+    # reference the equivalences
+    # Send them in batches, instead of a couple of queries per equivalence
+    # The batches are sent one after another, so that if one fails the error aborts
+    # the sync right away, without writing any more rows
+    for i in range(0, len(equivs), _INSERT_BATCH_SIZE):
+        await DbEquivalence.prisma().create_many(
+            data=equivs[i : i + _INSERT_BATCH_SIZE],
+        )
+    for i in range(0, len(equiv_courses), _INSERT_BATCH_SIZE):
+        await DbEquivalenceCourse.prisma().create_many(
+            data=equiv_courses[i : i + _INSERT_BATCH_SIZE],
         )
 
 
@@ -207,6 +260,8 @@ async def _store_curriculum_offer_to_db(storage: CurriculumStorage):
     the database.
     """
 
+    log.info("  syncing curriculum offer")
+
     # Delete the previous offer
     await DbMajor.prisma().delete_many()
     await DbMinor.prisma().delete_many()
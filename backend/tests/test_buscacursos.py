@@ -0,0 +1,71 @@
+import asyncio
+import lzma
+from collections.abc import AsyncIterator
+
+import pytest
+from app.plan.validation.courses.logic import (
+    And,
+    MinCredits,
+    Or,
+    ReqCourse,
+    ReqLevel,
+)
+from app.sync.buscacursos_dl import _decompress_xz, parse_reqs, parse_restr
+
+
+def test_parse_single_req():
+    assert parse_reqs("IIC1103") == ReqCourse(code="IIC1103", coreq=False)
+    assert parse_reqs("IIC1103(c)") == ReqCourse(code="IIC1103", coreq=True)
+    assert parse_reqs(" IIC1103 (c) ") == ReqCourse(code="IIC1103", coreq=True)
+
+
+def test_parse_precedence():
+    a = ReqCourse(code="A1", coreq=False)
+    b = ReqCourse(code="B1", coreq=False)
+    c = ReqCourse(code="C1", coreq=True)
+    assert parse_reqs("A1 o B1 y C1(c)") == Or(children=(a, And(children=(b, c))))
+    assert parse_reqs("(A1 o B1) y C1(c)") == And(children=(Or(children=(a, b)), c))
+    assert parse_reqs("((A1)) Y B1") == And(children=(a, b))
+
+
+def test_parse_restr():
+    assert parse_restr("(Nivel = Pregrado) o (Creditos >= 100)") == Or(
+        children=(ReqLevel(level="Pregrado", equal=True), MinCredits(min_credits=100)),
+    )
+    assert parse_restr("Nivel <> Magister") == ReqLevel(level="Magister", equal=False)
+
+
+@pytest.mark.parametrize(
+    "reqs",
+    ["", "A1 y", "(A1 o B1", "A1 B1", "A1(x)", "()"],
+)
+def test_parse_invalid_reqs(reqs: str):
+    with pytest.raises(Exception, match="invalid requirements"):
+        parse_reqs(reqs)
+
+
+@pytest.mark.parametrize(
+    "restr",
+    ["Nivel", "(Creditos = 100)", "(Creditos >= muchos)", "(Color = Azul)"],
+)
+def test_parse_invalid_restr(restr: str):
+    with pytest.raises(Exception, match="invalid restrictions"):
+        parse_restr(restr)
+
+
+async def _in_chunks(data: bytes, size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+def test_decompress_concatenated_streams():
+    """
+    Concatenated xz streams are all decompressed, even if a chunk spans two streams.
+    """
+
+    blob = lzma.compress(b'{"IIC2233": ') + lzma.compress(b"{}}")
+    for size in [7, 64, len(blob)]:
+        assert asyncio.run(_decompress_xz(_in_chunks(blob, size))) == b'{"IIC2233": {}}'
+
+    with pytest.raises(Exception, match="truncated"):
+        asyncio.run(_decompress_xz(_in_chunks(blob[:-5], 7)))
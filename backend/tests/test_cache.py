@@ -0,0 +1,112 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+from app.settings import settings
+from app.sync import cache
+from app.sync.cache import CURRICULUM_VERSION_KEY, CacheService, CacheStats
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data: dict[str, int] = {}
+
+    async def get(self, key: str) -> int | None:
+        return self.data.get(key)
+
+    async def incr(self, key: str) -> int:
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> SimpleNamespace:
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(settings, "static_data_check_interval", 10)
+    return clock
+
+
+@pytest.fixture
+def redis(monkeypatch: pytest.MonkeyPatch) -> FakeRedis:
+    redis = FakeRedis()
+
+    @contextlib.asynccontextmanager
+    async def get_redis():
+        yield redis
+
+    monkeypatch.setattr(cache, "get_redis", get_redis)
+    return redis
+
+
+def test_curriculum_stale_check_interval(clock: SimpleNamespace, redis: FakeRedis):
+    """
+    Redis is only queried once every `static_data_check_interval` seconds.
+    """
+
+    service = CacheService()
+    service.curriculum_version = 0
+    service.version_checked_at = clock.now
+    redis.data[CURRICULUM_VERSION_KEY] = 1
+
+    clock.now += 5
+    assert not asyncio.run(service.is_curriculum_stale())
+
+    clock.now += 6
+    assert asyncio.run(service.is_curriculum_stale())
+    # Only the first caller after the interval sees the stale data
+    assert not asyncio.run(service.is_curriculum_stale())
+
+
+def test_curriculum_stale_version_compare(clock: SimpleNamespace, redis: FakeRedis):
+    """
+    The data is only stale if the version in Redis differs from the loaded one.
+    """
+
+    service = CacheService()
+    service.curriculum_version = 3
+    redis.data[CURRICULUM_VERSION_KEY] = 3
+    assert not asyncio.run(service.is_curriculum_stale())
+
+    clock.now += 11
+    redis.data[CURRICULUM_VERSION_KEY] = 4
+    assert asyncio.run(service.is_curriculum_stale())
+
+
+def test_curriculum_stale_stats(clock: SimpleNamespace, redis: FakeRedis):
+    """
+    Only actual version checks are counted, as hits if the data was up to date and as
+    misses if it was stale.
+    """
+
+    service = CacheService()
+    service.curriculum_version = 1
+    redis.data[CURRICULUM_VERSION_KEY] = 1
+    asyncio.run(service.is_curriculum_stale())
+    # Skipped checks are not counted
+    clock.now += 5
+    asyncio.run(service.is_curriculum_stale())
+    assert service.static_stats == CacheStats(hits=1, misses=0)
+
+    clock.now += 6
+    redis.data[CURRICULUM_VERSION_KEY] = 2
+    asyncio.run(service.is_curriculum_stale())
+    assert service.static_stats == CacheStats(hits=1, misses=1)
+    assert service.static_stats.hit_rate() == 0.5
+
+
+def test_bump_curriculum_version(clock: SimpleNamespace, redis: FakeRedis):
+    """
+    Bumping the version makes other workers see their data as stale.
+    """
+
+    service = CacheService()
+    service.curriculum_version = asyncio.run(service.fetch_curriculum_version())
+    assert service.curriculum_version == 0
+
+    asyncio.run(service.bump_curriculum_version())
+    assert redis.data[CURRICULUM_VERSION_KEY] == 1
+
+    clock.now += 11
+    assert asyncio.run(service.is_curriculum_stale())
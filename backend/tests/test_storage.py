@@ -0,0 +1,31 @@
+from app.plan.validation.curriculum.tree import MajorCode, MinorCode
+from app.sync.curriculums.storage import CurriculumStorage, ProgramDetails
+
+
+def test_storage_roundtrip_with_code_keys():
+    """
+    Offers are keyed by `MajorCode`/`MinorCode`, which are `str` subclasses.
+    The packed storage must still serialize and load back.
+    """
+
+    storage = CurriculumStorage()
+    offer = storage.offer["C2020"]
+    offer.major[MajorCode("M170")] = ProgramDetails(
+        code="M170",
+        name="Major en Ingeniería de Software",
+        version="1",
+        program_type="",
+    )
+    offer.minor[MinorCode("N204")] = ProgramDetails(
+        code="N204",
+        name="Minor en Análisis Numérico",
+        version="2",
+        program_type="Amplitud",
+    )
+    offer.major_minor[MajorCode("M170")] = [MinorCode("N204")]
+
+    loaded = CurriculumStorage.parse_raw(storage.json())
+
+    assert loaded.offer["C2020"].major["M170"].name == "Major en Ingeniería de Software"
+    assert loaded.offer["C2020"].minor["N204"].program_type == "Amplitud"
+    assert loaded.offer["C2020"].major_minor == {"M170": ["N204"]}